@@ -55,16 +55,14 @@ from datetime import timedelta, datetime
 from homeassistant.config_entries import SOURCE_IMPORT, ConfigEntry
 from homeassistant.core import HomeAssistant
 from homeassistant.const import (
-    CONF_DEVICE_ID,
     CONF_PLATFORM,
     CONF_ENTITIES,
 )
 from homeassistant.helpers.event import async_track_time_interval
-from homeassistant.helpers.dispatcher import async_dispatcher_send
 
 from .const import DOMAIN, TUYA_DEVICE
 from .config_flow import config_schema
-from .common import TuyaDevice
+from .common import TuyaDevice, remove_entity_index
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -104,8 +102,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
         except Exception:
             _LOGGER.debug("update failed")
 
-        signal = f"localtuya_{entry.data[CONF_DEVICE_ID]}"
-        async_dispatcher_send(hass, signal, status)
+        device.update_status(status)
 
     unsub_track = async_track_time_interval(
         hass, update_state, timedelta(seconds=POLL_INTERVAL)
@@ -149,6 +146,7 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
 
     hass.data[DOMAIN][entry.entry_id][UNSUB_LISTENER]()
     hass.data[DOMAIN][entry.entry_id][UNSUB_TRACK]()
+    remove_entity_index(entry)
     if unload_ok:
         hass.data[DOMAIN].pop(entry.entry_id)
 
@@ -3,11 +3,8 @@ import logging
 from time import time, sleep
 from threading import Lock
 
+from homeassistant.core import callback
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.dispatcher import (
-    async_dispatcher_connect,
-    async_dispatcher_send,
-)
 
 from homeassistant.const import (
     CONF_DEVICE_ID,
@@ -23,14 +20,37 @@ from .const import CONF_LOCAL_KEY, CONF_PROTOCOL_VERSION, DOMAIN, TUYA_DEVICE
 
 _LOGGER = logging.getLogger(__name__)
 
+# Seconds a polled status is reused before the device is queried again
+STATUS_CACHE_TTL = 10
+
+
+# Entity configs indexed per config entry id, rebuilt whenever entry data is replaced
+_ENTITY_INDEX = {}
+
+
+def _entity_index(config_entry):
+    """Return entity configs of a config entry grouped by id and by platform."""
+    data = config_entry.data
+    index = _ENTITY_INDEX.get(config_entry.entry_id)
+    if index is None or index[0] is not data:
+        by_id = {}
+        by_platform = {}
+        for entity in data[CONF_ENTITIES]:
+            by_id.setdefault(entity[CONF_ID], entity)
+            by_platform.setdefault(entity[CONF_PLATFORM], []).append(entity)
+        index = (data, by_id, by_platform)
+        _ENTITY_INDEX[config_entry.entry_id] = index
+    return index
+
+
+def remove_entity_index(config_entry):
+    """Drop the entity config index of a config entry."""
+    _ENTITY_INDEX.pop(config_entry.entry_id, None)
+
 
 def prepare_setup_entities(hass, config_entry, platform):
     """Prepare ro setup entities for a platform."""
-    entities_to_setup = [
-        entity
-        for entity in config_entry.data[CONF_ENTITIES]
-        if entity[CONF_PLATFORM] == platform
-    ]
+    entities_to_setup = _entity_index(config_entry)[2].get(platform)
     if not entities_to_setup:
         return None, None
 
@@ -41,10 +61,10 @@ def prepare_setup_entities(hass, config_entry, platform):
 
 def get_entity_config(config_entry, dps_id):
     """Return entity config for a given DPS id."""
-    for entity in config_entry.data[CONF_ENTITIES]:
-        if entity[CONF_ID] == dps_id:
-            return entity
-    raise Exception(f"missing entity config for id {dps_id}")
+    entity = _entity_index(config_entry)[1].get(dps_id)
+    if entity is None:
+        raise Exception(f"missing entity config for id {dps_id}")
+    return entity
 
 
 class TuyaDevice:
@@ -66,12 +86,62 @@ class TuyaDevice:
         self._friendly_name = config_entry[CONF_FRIENDLY_NAME]
         self._hass = hass
         self._lock = Lock()
+        self._listeners = {}
+        self._status = None
+        self._dps_snapshot = {}
 
     @property
     def unique_id(self):
         """Return unique device identifier."""
         return self._interface.id
 
+    @callback
+    def add_listener(self, dps_ids, update_callback):
+        """Register a callback for changes of any of the given DPS ids."""
+        dps_ids = {str(dps_id) for dps_id in dps_ids}
+        for dps_id in dps_ids:
+            self._listeners.setdefault(dps_id, []).append(update_callback)
+
+        # Late listeners would otherwise not see anything until a DPS changes
+        if self._status is not None:
+            update_callback(self._status)
+
+        @callback
+        def remove_listener():
+            for dps_id in dps_ids:
+                self._listeners[dps_id].remove(update_callback)
+
+        return remove_listener
+
+    @callback
+    def update_status(self, status):
+        """Notify listeners of the DPS that changed since the previous status."""
+        if status is None:
+            if self._status is None:
+                return
+            changed = self._listeners.keys()
+            self._dps_snapshot = {}
+        else:
+            dps = status.get("dps", {})
+            if self._status is None:
+                changed = self._listeners.keys()
+            else:
+                changed = [
+                    dps_id
+                    for dps_id in dps.keys() | self._dps_snapshot.keys()
+                    if dps.get(dps_id) != self._dps_snapshot.get(dps_id)
+                ]
+            self._dps_snapshot = dict(dps)
+        self._status = status
+
+        # An entity tracking several changed DPS is only called once
+        callbacks = {}
+        for dps_id in changed:
+            for update_callback in self._listeners.get(dps_id, ()):
+                callbacks[update_callback] = None
+        for update_callback in callbacks:
+            update_callback(status)
+
     def __get_status(self):
         _LOGGER.debug("running def __get_status from TuyaDevice")
         for i in range(5):
@@ -96,29 +166,62 @@ class TuyaDevice:
         """Change value of a DP of the Tuya device and update the cached status."""
         # _LOGGER.info("running def set_dps from TuyaDevice")
         # No need to clear the cache here: let's just update the status of the
-        # changed dps as returned by the interface (see 5 lines below)
+        # changed dps as returned by the interface (see below)
         # self._cached_status = ""
         # self._cached_status_time = 0
         for i in range(5):
-            try:
-                result = self._interface.set_dps(state, dps_index)
-                self._cached_status["dps"].update(result["dps"])
-                signal = f"localtuya_{self._interface.id}"
-                async_dispatcher_send(self._hass, signal, self._cached_status)
-                return
-            except Exception as e:
-                print(
-                    "Failed to set status of device [{}]: [{}]".format(
-                        self._interface.address, e
-                    )
+            # Lock per attempt so the backoff below does not block other users
+            with self._lock:
+                try:
+                    result = self._interface.set_dps(state, dps_index)
+                except Exception as e:
+                    error = e
+                else:
+                    # Only merge into the cache after the command went through, a
+                    # response without dps must not make us send the command again
+                    pushed = bool(result and "dps" in result)
+                    if pushed and self._cached_status:
+                        self._cached_status.setdefault("dps", {}).update(result["dps"])
+                    elif not pushed:
+                        # Expire the cache so refresh_status() queries the device
+                        self._cached_status_time = 0
+                    break
+
+            _LOGGER.warning(
+                "Failed to set status of device %s: %s",
+                self._interface.address,
+                error,
+            )
+            if i + 1 == 5:
+                _LOGGER.error(
+                    "Failed to set status of device %s", self._interface.address
                 )
-                if i + 1 == 3:
-                    _LOGGER.error(
-                        "Failed to set status of device %s", self._interface.address
-                    )
-                    return
+                return
+            # Back off before reconnecting, a busy device rejects connections made
+            # in quick succession
+            sleep(min(2 ** i, 8))
+
+        if not pushed:
+            # Nothing pushed back to merge: query the device in the background
+            # rather than leaving entities stale until the next poll
+            self._hass.add_job(self.refresh_status)
+            return
+
+        with self._lock:
+            if not self._cached_status:
+                return
+            dps = self._cached_status.get("dps", {})
+            status = dict(self._cached_status, dps=dict(dps))
+        self._hass.add_job(self.update_status, status)
 
-    #                    raise ConnectionError("Failed to set status.")
+    def refresh_status(self):
+        """Query the status of the Tuya device and notify listeners."""
+        try:
+            status = self.status()
+        except Exception:
+            _LOGGER.debug("Failed to refresh status of %s", self._interface.address)
+            return
+        self._hass.add_job(self.update_status, status)
 
     def status(self):
         """Get the state of the Tuya device and cache the results."""
@@ -126,7 +229,8 @@ class TuyaDevice:
         self._lock.acquire()
         try:
             now = time()
-            if not self._cached_status or now - self._cached_status_time > 10:
+            expired = now - self._cached_status_time > STATUS_CACHE_TTL
+            if not self._cached_status or expired:
                 sleep(0.5)
                 self._cached_status = self.__get_status()
                 self._cached_status_time = time()
@@ -160,9 +264,8 @@ class LocalTuyaEntity(Entity):
 
             self.schedule_update_ha_state()
 
-        signal = f"localtuya_{self._config_entry.data[CONF_DEVICE_ID]}"
         self.async_on_remove(
-            async_dispatcher_connect(self.hass, signal, _update_handler)
+            self._device.add_listener(self._tracked_dps(), _update_handler)
         )
 
     @property
@@ -204,6 +307,13 @@ class LocalTuyaEntity(Entity):
         """Return if device is available or not."""
         return bool(self._status)
 
+    def _tracked_dps(self):
+        """Return the DPS ids whose changes should update this entity.
+
+        Override in subclasses that read more DPS than their own.
+        """
+        return {self._dps_id}
+
     def dps(self, dps_index):
         """Return cached value for DPS index."""
         if "dps" not in self._status:
@@ -175,6 +175,13 @@ class LocaltuyaCover(LocalTuyaEntity, CoverEntity):
         _LOGGER.debug("Launching command %s to cover ", COVER_STOP_CMD)
         self._device.set_dps(COVER_STOP_CMD, self._dps_id)
 
+    def _tracked_dps(self):
+        """Return the DPS ids whose changes should update this entity."""
+        tracked = super()._tracked_dps()
+        if self.has_config(CONF_CURRENT_POSITION_DP):
+            tracked.add(self._config[CONF_CURRENT_POSITION_DP])
+        return tracked
+
     def status_updated(self):
         """Device status was updated."""
         self._state = self.dps(self._dps_id)
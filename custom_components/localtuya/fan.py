@@ -118,6 +118,10 @@ class LocaltuyaFan(LocalTuyaEntity, FanEntity):
         """Flag supported features."""
         return SUPPORT_SET_SPEED | SUPPORT_OSCILLATE
 
+    def _tracked_dps(self):
+        """Return the DPS ids whose changes should update this entity."""
+        return super()._tracked_dps() | {"1", "2", "8"}
+
     def status_updated(self):
         """Get state of Tuya fan."""
         self._is_on = self._status["dps"]["1"]
@@ -129,6 +129,10 @@ class LocaltuyaLight(LocalTuyaEntity, LightEntity):
         """Turn Tuya light off."""
         self._device.set_dps(False, self._dps_id)
 
+    def _tracked_dps(self):
+        """Return the DPS ids whose changes should update this entity."""
+        return super()._tracked_dps() | {DPS_INDEX_BRIGHTNESS, DPS_INDEX_COLOURTEMP}
+
     def status_updated(self):
         """Device status was updated."""
         self._state = self.dps(self._dps_id)
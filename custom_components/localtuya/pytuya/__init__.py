@@ -42,14 +42,27 @@ import json
 import logging
 import socket
 import time
-import binascii
 import struct
+import zlib
 from collections import namedtuple
 from contextlib import contextmanager
+from functools import lru_cache
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+try:
+    from orjson import dumps as _json_dumps, loads as _json_loads
+except ImportError:
+
+    def _json_dumps(obj):
+        """Serialize obj to compact JSON bytes."""
+        # Same output as orjson: no whitespace, non-ASCII written as UTF-8
+        text = json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+        return text.encode("utf-8")
+
+    _json_loads = json.loads
+
 version_tuple = (8, 1, 0)
 version = version_string = __version__ = "%d.%d.%d" % version_tuple
 __author__ = "rospogrigio"
@@ -70,6 +83,12 @@ MESSAGE_HEADER_FMT = ">4I"  # 4*uint32: prefix, seqno, cmd, length
 MESSAGE_RECV_HEADER_FMT = ">5I"  # 4*uint32: prefix, seqno, cmd, length, retcode
 MESSAGE_END_FMT = ">2I"  # 2*uint32: crc, suffix
 
+MESSAGE_HEADER = struct.Struct(MESSAGE_HEADER_FMT)
+MESSAGE_RECV_HEADER = struct.Struct(MESSAGE_RECV_HEADER_FMT)
+MESSAGE_END = struct.Struct(MESSAGE_END_FMT)
+
+BACKEND = default_backend()
+
 PREFIX_VALUE = 0x000055AA
 SUFFIX_VALUE = 0x0000AA55
 
@@ -94,6 +113,16 @@ PAYLOAD_DICT = {
     },
 }
 
+# Ranges of dps probed by detect_available_dps (see there), as strings
+DETECT_DPS_RANGES = [
+    tuple(map(str, range(*dps_range)))
+    for dps_range in [(2, 11), (11, 21), (21, 31), (100, 111)]
+]
+
+# Device type detected for a device id, so new interfaces to a type_0d device
+# do not need a failing type_0a request before switching
+DEVICE_TYPES = {}
+
 
 @contextmanager
 def socketcontext(address, port, timeout):
@@ -115,36 +144,31 @@ def socketcontext(address, port, timeout):
 
 
 def pack_message(msg):
-    """Pack a TuyaMessage into bytes."""
-    # Create full message excluding CRC and suffix
-    buffer = (
-        struct.pack(
-            MESSAGE_HEADER_FMT,
-            PREFIX_VALUE,
-            msg.seqno,
-            msg.cmd,
-            len(msg.payload) + struct.calcsize(MESSAGE_END_FMT),
-        )
-        + msg.payload
-    )
-
-    # Calculate CRC, add it together with suffix
-    buffer += struct.pack(MESSAGE_END_FMT, binascii.crc32(buffer), SUFFIX_VALUE)
-
+    """Pack a TuyaMessage into a bytearray."""
+    payload_end = MESSAGE_HEADER.size + len(msg.payload)
+    length = len(msg.payload) + MESSAGE_END.size
+
+    # Header, payload, CRC and suffix are written into a single buffer
+    buffer = bytearray(payload_end + MESSAGE_END.size)
+    MESSAGE_HEADER.pack_into(buffer, 0, PREFIX_VALUE, msg.seqno, msg.cmd, length)
+    buffer[MESSAGE_HEADER.size : payload_end] = msg.payload
+
+    with memoryview(buffer) as view:
+        crc = zlib.crc32(view[:payload_end])
+    MESSAGE_END.pack_into(buffer, payload_end, crc, SUFFIX_VALUE)
     return buffer
 
 
-def unpack_message(data):
-    """Unpack bytes into a TuyaMessage."""
-    header_len = struct.calcsize(MESSAGE_RECV_HEADER_FMT)
-    end_len = struct.calcsize(MESSAGE_END_FMT)
+@lru_cache(maxsize=64)
+def _cipher_for_key(key):
+    """Return a shared AES-ECB Cipher for key.
 
-    _, seqno, cmd, _, retcode = struct.unpack(
-        MESSAGE_RECV_HEADER_FMT, data[:header_len]
-    )
-    payload = data[header_len:-end_len]
-    crc, _ = struct.unpack(MESSAGE_END_FMT, data[-end_len:])
-    return TuyaMessage(seqno, cmd, retcode, payload, crc)
+    Cipher objects are immutable (a new context is created per operation), so one
+    per local key can be reused across reconnects. Keys that are no longer used
+    (mistyped in the config flow, removed or re-keyed devices) would otherwise stay
+    cached forever, so only the most recently used keys are kept.
+    """
+    return Cipher(algorithms.AES(key), modes.ECB(), BACKEND)
 
 
 class AESCipher:
@@ -153,7 +177,9 @@ class AESCipher:
     def __init__(self, key):
         """Initialize a new AESCipher."""
         self.bs = 16
-        self.cipher = Cipher(algorithms.AES(key), modes.ECB(), default_backend())
+        # Precomputed PKCS#7 padding for every possible pad length (1..bs)
+        self._pad_table = [bytes([n]) * n for n in range(1, self.bs + 1)]
+        self.cipher = _cipher_for_key(bytes(key))
 
     def encrypt(self, raw, use_base64=True):
         """Encrypt data to be sent to device."""
@@ -170,12 +196,11 @@ class AESCipher:
         return self._unpad(decryptor.update(enc) + decryptor.finalize()).decode()
 
     def _pad(self, s):
-        padnum = self.bs - len(s) % self.bs
-        return s + padnum * chr(padnum).encode()
+        return s + self._pad_table[self.bs - len(s) % self.bs - 1]
 
     @staticmethod
     def _unpad(s):
-        return s[: -ord(s[len(s) - 1 :])]
+        return s[: -s[-1]]
 
 
 class TuyaInterface:
@@ -200,10 +225,35 @@ class TuyaInterface:
         self.local_key = local_key.encode("latin1")
         self.connection_timeout = connection_timeout
         self.version = protocol_version
-        self.dev_type = "type_0a"
-        self.dps_to_request = {}
+        self.dev_type = DEVICE_TYPES.get(dev_id, "type_0a")
+        self.dps_to_request = set()
+        self._dps_request_data = None
         self.cipher = AESCipher(self.local_key)
         self.seqno = 0
+        # The protocol version is fixed per device, select its codec only once
+        if protocol_version == 3.3:
+            self._decode_payload = self._decode_payload_33
+            self._encode_payload = self._encode_payload_33
+        else:
+            self._decode_payload = self._decode_payload_31
+            self._encode_payload = self._encode_payload_31
+        self._timestamp = (0, "0")
+        # Constant parts of the string signed by MD5 in protocol 3.1 SET commands,
+        # the prefix is fed once and the hasher state copied for each command
+        self._md5_prefix_hasher = md5(b"data=")
+        self._md5_suffix = (
+            b"||lpv=" + PROTOCOL_VERSION_BYTES_31 + b"||" + self.local_key
+        )
+
+        # gwId, devId and uid all carry the device id (no separate uid is used), so
+        # prepare a private copy of each command template with them filled in
+        self._payload_templates = {
+            (dev_type, command): {
+                key: None if key == "t" else self.id for key in cmd_data["command"]
+            }
+            for dev_type, commands in PAYLOAD_DICT.items()
+            for command, cmd_data in commands.items()
+        }
 
         self.port = 6668  # default - do not expect caller to pass in
 
@@ -214,18 +264,12 @@ class TuyaInterface:
         dev_type = self.dev_type
 
         with socketcontext(self.address, self.port, self.connection_timeout) as s:
-            s.send(payload)
-            data = s.recv(1024)
-
-            # sometimes the first packet does not contain data (typically 28 bytes):
-            # need to read again
-            if len(data) < 40:
-                time.sleep(0.1)
-                data = s.recv(1024)
-
-            msg = unpack_message(data)
-            # TODO: Verify stuff, e.g. CRC sequence number
+            s.sendall(payload)
+            msg = self._receive_message(s)
+            # TODO: Verify stuff, e.g. sequence number
 
+            if _LOGGER.isEnabledFor(logging.DEBUG):
+                _LOGGER.debug("decode payload=%r", bytes(msg.payload))
             payload = self._decode_payload(msg.payload)
 
         # Perform a new exchange (once) if we switched device type
@@ -239,6 +283,47 @@ class TuyaInterface:
             return self.exchange(command, dps)
         return payload
 
+    @staticmethod
+    def _receive_message(s):
+        """Read from socket until a message carrying a payload has been received."""
+        buffer = bytearray()
+        offset = 0
+        while True:
+            while len(buffer) - offset >= MESSAGE_RECV_HEADER.size:
+                prefix, seqno, cmd, length, retcode = MESSAGE_RECV_HEADER.unpack_from(
+                    buffer, offset
+                )
+                if prefix != PREFIX_VALUE:
+                    raise Exception(f"Unexpected message prefix={prefix:#x}")
+
+                msg_end = offset + MESSAGE_HEADER.size + length
+                if len(buffer) < msg_end:
+                    break  # message is incomplete, wait for more data
+
+                payload_start = offset + MESSAGE_RECV_HEADER.size
+                payload_end = msg_end - MESSAGE_END.size
+                crc, _ = MESSAGE_END.unpack_from(buffer, payload_end)
+                with memoryview(buffer) as view:
+                    if zlib.crc32(view[offset:payload_end]) != crc:
+                        raise Exception(f"CRC mismatch in message seqno={seqno}")
+                offset = msg_end
+
+                # sometimes the first message does not contain data (typically 28
+                # bytes): need to keep reading
+                if payload_end > payload_start:
+                    # buffer is not modified anymore, hand out a view instead of a copy
+                    payload = memoryview(buffer)[payload_start:payload_end]
+                    return TuyaMessage(seqno, cmd, retcode, payload, crc)
+
+            # Drop consumed messages, only a partial message (if any) is kept
+            del buffer[:offset]
+            offset = 0
+
+            data = s.recv(1024)
+            if not data:
+                raise Exception("Connection closed before a response was received")
+            buffer.extend(data)
+
     def status(self):
         """Return device status."""
         return self.exchange(STATUS)
@@ -260,13 +345,12 @@ class TuyaInterface:
         # in the ranges [1-25] and [100-110] need to split the bruteforcing in
         # different steps due to request payload limitation (max. length = 255)
         detected_dps = {}
-        ranges = [(2, 11), (11, 21), (21, 31), (100, 111)]
 
-        for dps_range in ranges:
+        for dps_range in DETECT_DPS_RANGES:
             # dps 1 must always be sent, otherwise it might fail in case no dps is found
             # in the requested range
-            self.dps_to_request = {"1": None}
-            self.add_dps_to_request(range(*dps_range))
+            self.dps_to_request = {"1", *dps_range}
+            self._dps_request_data = None
             try:
                 data = self.status()
             except Exception as e:
@@ -281,40 +365,78 @@ class TuyaInterface:
 
     def add_dps_to_request(self, dps_index):
         """Add a datapoint (DP) to be included in requests."""
-        if isinstance(dps_index, int):
-            self.dps_to_request[str(dps_index)] = None
+        if isinstance(dps_index, (int, str)):
+            self.dps_to_request.add(str(dps_index))
         else:
-            self.dps_to_request.update({str(index): None for index in dps_index})
-
-    def _decode_payload(self, payload):
-        _LOGGER.debug("decode payload=%r", payload)
-
-        if payload.startswith(PROTOCOL_VERSION_BYTES_31):
-            payload = payload[len(PROTOCOL_VERSION_BYTES_31) :]  # remove version header
+            self.dps_to_request.update(map(str, dps_index))
+        self._dps_request_data = None
+
+    def _now(self):
+        """Return the current time in seconds as string, reformatted once a second."""
+        now = int(time.time())
+        if now != self._timestamp[0]:
+            self._timestamp = (now, str(now))
+        return self._timestamp[1]
+
+    def _decode_payload_31(self, payload):
+        # payload may be a memoryview (no startswith), so compare sliced prefixes
+        version_len = len(PROTOCOL_VERSION_BYTES_31)
+        if payload[:version_len] == PROTOCOL_VERSION_BYTES_31:
+            payload = payload[version_len:]  # remove version header
             # remove (what I'm guessing, but not confirmed is) 16-bytes of MD5
             # hexdigest of payload
             payload = self.cipher.decrypt(payload[16:])
-        elif self.version == 3.3:
-            if self.dev_type != "type_0a" or payload.startswith(
-                PROTOCOL_VERSION_BYTES_33
-            ):
-                payload = payload[len(PROTOCOL_33_HEADER) :]
-            payload = self.cipher.decrypt(payload, False)
-
-            if "data unvalid" in payload:
-                self.dev_type = "type_0d"
-                _LOGGER.debug(
-                    "'data unvalid' error detected: switching to dev_type %r",
-                    self.dev_type,
-                )
-                return None
-        elif not payload.startswith(b"{"):
-            raise Exception(f"Unexpected payload={payload}")
+        elif payload[:1] == b"{":
+            payload = bytes(payload)  # json.loads does not accept memoryview
+        else:
+            raise Exception(f"Unexpected payload={bytes(payload)}")
 
-        if not isinstance(payload, str):
-            payload = payload.decode()
         _LOGGER.debug("decrypted result=%r", payload)
-        return json.loads(payload)
+        return _json_loads(payload)
+
+    def _decode_payload_33(self, payload):
+        version_len = len(PROTOCOL_VERSION_BYTES_33)
+        if (
+            self.dev_type != "type_0a"
+            or payload[:version_len] == PROTOCOL_VERSION_BYTES_33
+        ):
+            payload = payload[len(PROTOCOL_33_HEADER) :]
+        payload = self.cipher.decrypt(payload, False)
+
+        if "data unvalid" in payload:
+            self.dev_type = DEVICE_TYPES[self.id] = "type_0d"
+            _LOGGER.debug(
+                "'data unvalid' error detected: switching to dev_type %r",
+                self.dev_type,
+            )
+            return None
+
+        _LOGGER.debug("decrypted result=%r", payload)
+        return _json_loads(payload)
+
+    def _encode_payload_31(self, payload, command, command_hb):
+        if command != SET:
+            return payload
+
+        payload = self.cipher.encrypt(payload)
+        m = self._md5_prefix_hasher.copy()
+        m.update(payload)
+        m.update(self._md5_suffix)
+        # version + 16 chars of the MD5 hexdigest + encrypted payload, written
+        # into a single buffer instead of concatenating intermediate bytes
+        version_len = len(PROTOCOL_VERSION_BYTES_31)
+        signed = bytearray(version_len + 16 + len(payload))
+        signed[:version_len] = PROTOCOL_VERSION_BYTES_31
+        signed[version_len : version_len + 16] = m.hexdigest()[8:24].encode()
+        signed[version_len + 16 :] = payload
+        return signed
+
+    def _encode_payload_33(self, payload, command, command_hb):
+        payload = self.cipher.encrypt(payload, False)
+        if command_hb != 0x0A:
+            # add the 3.3 header
+            payload = PROTOCOL_33_HEADER + payload
+        return payload
 
     def _generate_payload(self, command, data=None):
         """
@@ -326,50 +448,26 @@ class TuyaInterface:
             data(dict, optional): The data to be send.
                 This is what will be passed via the 'dps' entry
         """
-        cmd_data = PAYLOAD_DICT[self.dev_type][command]
-        json_data = cmd_data["command"]
-        command_hb = cmd_data["hexByte"]
-
-        if "gwId" in json_data:
-            json_data["gwId"] = self.id
-        if "devId" in json_data:
-            json_data["devId"] = self.id
-        if "uid" in json_data:
-            json_data["uid"] = self.id  # still use id, no separate uid
+        command_hb = PAYLOAD_DICT[self.dev_type][command]["hexByte"]
+        json_data = self._payload_templates[(self.dev_type, command)].copy()
+
         if "t" in json_data:
-            json_data["t"] = str(int(time.time()))
+            json_data["t"] = self._now()
 
         if data is not None:
             json_data["dps"] = data
         if command_hb == 0x0D:
-            json_data["dps"] = self.dps_to_request
+            if self._dps_request_data is None:
+                # Requested dps are sent with null values, e.g. {"1": null, ...}
+                self._dps_request_data = dict.fromkeys(
+                    sorted(self.dps_to_request, key=int)
+                )
+            json_data["dps"] = self._dps_request_data
 
-        payload = json.dumps(json_data).replace(" ", "").encode("utf-8")
+        payload = _json_dumps(json_data)
         _LOGGER.debug("paylod=%r", payload)
 
-        if self.version == 3.3:
-            payload = self.cipher.encrypt(payload, False)
-            if command_hb != 0x0A:
-                # add the 3.3 header
-                payload = PROTOCOL_33_HEADER + payload
-        elif command == SET:
-            payload = self.cipher.encrypt(payload)
-            preMd5String = (
-                b"data="
-                + payload
-                + b"||lpv="
-                + PROTOCOL_VERSION_BYTES_31
-                + b"||"
-                + self.local_key
-            )
-            m = md5()
-            m.update(preMd5String)
-            hexdigest = m.hexdigest()
-            payload = (
-                PROTOCOL_VERSION_BYTES_31
-                + hexdigest[8:][:16].encode("latin1")
-                + payload
-            )
+        payload = self._encode_payload(payload, command, command_hb)
 
         msg = TuyaMessage(self.seqno, command_hb, 0, payload, 0)
         self.seqno += 1
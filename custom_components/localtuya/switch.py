@@ -94,6 +94,14 @@ class LocaltuyaSwitch(LocalTuyaEntity, SwitchEntity):
         """Turn Tuya switch off."""
         self._device.set_dps(False, self._dps_id)
 
+    def _tracked_dps(self):
+        """Return the DPS ids whose changes should update this entity."""
+        tracked = super()._tracked_dps()
+        for attr in (CONF_CURRENT, CONF_CURRENT_CONSUMPTION, CONF_VOLTAGE):
+            if self.has_config(attr):
+                tracked.add(self._config[attr])
+        return tracked
+
     def status_updated(self):
         """Device status was updated."""
         self._state = self.dps(self._dps_id)